@@ -1,434 +1,711 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.middleware.cors import CORSMiddleware
-import asyncio
-import json
-import os
-import random
-from typing import Dict, List, Optional
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Renk sırası
-colors_order = ["blue", "red", "green", "yellow"]
-
-
-# ------------------------------
-# PLAYER
-# ------------------------------
-class Player:
-    def __init__(self, websocket: WebSocket, color: str):
-        self.websocket = websocket
-        self.color = color
-        self.name: Optional[str] = None
-        self.is_bot: bool = False
-
-    @property
-    def label(self):
-        if self.name:
-            return self.name
-        if self.is_bot:
-            return "ai"
-        return self.color
-
-
-# ------------------------------
-# GAME STATE (ODA BAZLI)
-# ------------------------------
-class GameState:
-    def __init__(self):
-        self.started = False
-        self.max_players = 4
-        self.map_radius = 3
-        self.difficulty = 2
-
-        self.players_by_ws: Dict[WebSocket, Player] = {}
-        self.players_by_color: Dict[str, Player] = {}
-
-        self.cells: Dict[int, dict] = {}
-        self.last_moves: List[dict] = []
-        self.current_player_color: Optional[str] = None
-
-        self.lock = asyncio.Lock()
-
-    def reset_game(self):
-        self.started = False
-        self.cells = {}
-        self.last_moves = []
-        self.current_player_color = None
-
-    def players_info_payload(self):
-        info = {}
-        for col, p in self.players_by_color.items():
-            info[col] = {"name": p.name, "is_bot": p.is_bot}
-        return info
-
-    def stats(self):
-        stats = {c: {"cells": 0, "troops": 0} for c in colors_order}
-        for cell in self.cells.values():
-            owner = cell.get("owner")
-            if owner in stats:
-                stats[owner]["cells"] += 1
-                stats[owner]["troops"] += cell.get("troops", 0)
-        return stats
-
-    def alive_colors(self):
-        s = self.stats()
-        return [c for c in colors_order if s[c]["cells"] > 0]
-
-
-# ------------------------------
-# TÜM ODALAR
-# ------------------------------
-rooms: Dict[str, GameState] = {}
-
-
-def get_room(room_id: str) -> GameState:
-    if room_id not in rooms:
-        rooms[room_id] = GameState()
-    return rooms[room_id]
-
-
-# ------------------------------
-# HELPER FUNCTIONS
-# ------------------------------
-async def send_json_safe(ws: WebSocket, payload: dict):
-    try:
-        await ws.send_text(json.dumps(payload))
-    except:
-        pass
-
-
-async def broadcast(room: GameState, payload: dict):
-    text = json.dumps(payload)
-    dead = []
-    for ws in list(room.players_by_ws.keys()):
-        try:
-            await ws.send_text(text)
-        except:
-            dead.append(ws)
-
-    for ws in dead:
-        await unregister(room, ws)
-
-
-async def unregister(room: GameState, ws: WebSocket):
-    async with room.lock:
-        player = room.players_by_ws.pop(ws, None)
-        if not player:
-            return
-
-        room.players_by_color.pop(player.color, None)
-
-        if not room.players_by_ws:
-            room.reset_game()
-            return
-
-        if room.started:
-            for cell in room.cells.values():
-                if cell.get("owner") == player.color:
-                    cell["owner"] = None
-                    cell["troops"] = 0
-
-            alive = room.alive_colors()
-            if len(alive) == 1:
-                winner = alive[0]
-                for p in room.players_by_ws.values():
-                    result = "win" if p.color == winner else "lose"
-                    await send_json_safe(p.websocket, {"type": "game_over", "result": result})
-                room.reset_game()
-            else:
-                if room.current_player_color == player.color:
-                    room.current_player_color = next_player_color(room)
-
-        await send_lobby(room)
-
-
-async def send_lobby(room: GameState):
-    payload = {
-        "type": "lobby",
-        "started": room.started,
-        "players_info": room.players_info_payload(),
-        "max_players": room.max_players,
-        "map_radius": room.map_radius,
-        "difficulty": room.difficulty
-    }
-    await broadcast(room, payload)
-
-
-def next_player_color(room: GameState) -> Optional[str]:
-    alive = room.alive_colors()
-    if not alive:
-        return None
-    if room.current_player_color not in alive:
-        return alive[0]
-    idx = alive.index(room.current_player_color)
-    return alive[(idx + 1) % len(alive)]
-
-
-def build_map(radius: int):
-    cells = {}
-    cid = 0
-    R = max(1, min(radius, 6))
-    for q in range(-R, R + 1):
-        r1 = max(-R, -q - R)
-        r2 = min(R, -q + R)
-        for r in range(r1, r2 + 1):
-            cells[cid] = {"id": cid, "q": q, "r": r, "owner": None, "troops": 0}
-            cid += 1
-    return cells
-
-
-def are_neighbors(id1, id2, cells):
-    s = cells.get(id1)
-    d = cells.get(id2)
-    if not s or not d:
-        return False
-    dq = d["q"] - s["q"]
-    dr = d["r"] - s["r"]
-    ds = -dq - dr
-    return (abs(dq), abs(dr), abs(ds)) in [(1, 0, 1), (1, 1, 0), (0, 1, 1)]
-
-
-def apply_transfer(room, color, src, dst, amount):
-    cells = room.cells
-    if src not in cells or dst not in cells:
-        return None
-
-    s = cells[src]
-    d = cells[dst]
-
-    if s["owner"] != color:
-        return None
-    if amount <= 0 or s["troops"] < amount:
-        return None
-    if not are_neighbors(src, dst, cells):
-        return None
-
-    s["troops"] -= amount
-
-    if d["owner"] is None:
-        d["owner"] = color
-        d["troops"] = amount
-        return "occupy"
-
-    if d["owner"] == color:
-        d["troops"] += amount
-        return "transfer"
-
-    # battle
-    if amount > d["troops"]:
-        d["owner"] = color
-        d["troops"] = amount - d["troops"]
-    else:
-        d["troops"] -= amount
-    return "battle"
-
-
-async def check_game_over(room: GameState):
-    alive = room.alive_colors()
-    if len(alive) == 1:
-        winner = alive[0]
-        for p in room.players_by_ws.values():
-            result = "win" if p.color == winner else "lose"
-            await send_json_safe(p.websocket, {"type": "game_over", "result": result})
-        room.reset_game()
-        await send_lobby(room)
-        return True
-    return False
-
-
-async def broadcast_state(room: GameState):
-    payload = {
-        "type": "state",
-        "cells": room.cells,
-        "moves": room.last_moves,
-        "current_player": room.current_player_color,
-        "players_info": room.players_info_payload(),
-        "started": room.started,
-        "max_players": room.max_players,
-        "map_radius": room.map_radius,
-        "difficulty": room.difficulty,
-    }
-    await broadcast(room, payload)
-
-
-# ------------------------------
-# WEBSOCKET ENDPOINT
-# ------------------------------
-@app.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket):
-    await ws.accept()
-
-    # ROOM ID OKU
-    room_id = ws.query_params.get("room", "default")
-    room = get_room(room_id)
-
-    # PLAYER KAYDEDİLİYOR
-    async with room.lock:
-        free = None
-        for c in colors_order:
-            if c not in room.players_by_color:
-                free = c
-                break
-
-        if free is None:
-            await send_json_safe(ws, {"type": "error", "message": "Oda dolu"})
-            await ws.close()
-            return
-
-        player = Player(ws, free)
-        room.players_by_ws[ws] = player
-        room.players_by_color[free] = player
-
-        await send_json_safe(ws, {"type": "you_are", "color": free})
-        await send_lobby(room)
-
-    try:
-        while True:
-            raw = await ws.receive_text()
-            msg = json.loads(raw)
-
-            async with room.lock:
-                player = room.players_by_ws.get(ws)
-                if not player:
-                    continue
-
-                m = msg.get("type")
-
-                # CONFIG
-                if m == "config":
-                    room.max_players = int(msg.get("max_players", 2))
-                    await send_lobby(room)
-                    continue
-
-                if m == "config_map":
-                    room.map_radius = int(msg.get("map_radius", 3))
-                    await send_lobby(room)
-                    continue
-
-                if m == "config_difficulty":
-                    room.difficulty = int(msg.get("difficulty", 2))
-                    await send_lobby(room)
-                    continue
-
-                # NAME
-                if m == "set_name":
-                    name = msg.get("name", "").strip()
-                    if name:
-                        player.name = name[:20]
-                    await send_lobby(room)
-                    continue
-
-                # EMOJI
-                if m == "emoji":
-                    await broadcast(room, {
-                        "type": "emoji",
-                        "emoji": msg.get("emoji", "🙂"),
-                        "from": player.label
-                    })
-                    continue
-
-                # START
-                if m == "start":
-                    if not room.started:
-                        if len(room.players_by_ws) < 2:
-                            await send_json_safe(ws, {"type": "error", "message": "En az 2 oyuncu gerekir"})
-                        else:
-                            room.cells = build_map(room.map_radius)
-
-                            order = list(room.players_by_ws.values())
-                            random.shuffle(order)
-
-                            ids = list(room.cells.keys())
-                            random.shuffle(ids)
-
-                            used = set()
-                            for p in order:
-                                cid = None
-                                for idd in ids:
-                                    if idd not in used:
-                                        cid = idd
-                                        used.add(idd)
-                                        break
-                                room.cells[cid]["owner"] = p.color
-                                room.cells[cid]["troops"] = 10
-
-                            room.started = True
-                            room.last_moves = []
-
-                            for c in colors_order:
-                                if c in room.players_by_color:
-                                    room.current_player_color = c
-                                    break
-
-                            await broadcast(room, {
-                                "type": "start_game",
-                                "cells": room.cells,
-                                "moves": room.last_moves,
-                                "current_player": room.current_player_color,
-                                "players_info": room.players_info_payload(),
-                            })
-                    continue
-
-                # TRANSFER
-                if m == "transfer":
-                    if not room.started:
-                        continue
-                    if room.current_player_color != player.color:
-                        continue
-
-                    src = int(msg["source"])
-                    dst = int(msg["target"])
-                    amt = int(msg["amount"])
-
-                    kind = apply_transfer(room, player.color, src, dst, amt)
-                    if not kind:
-                        continue
-
-                    room.last_moves.append({"src": src, "dst": dst, "color": player.color})
-                    room.last_moves = room.last_moves[-8:]
-
-                    await broadcast(room, {"type": "transfer_event", "kind": kind})
-
-                    for c in room.cells.values():
-                        if c["owner"] == player.color:
-                            c["troops"] = min(100, c["troops"] + 1)
-
-                    owned = [cid for cid, c in room.cells.items() if c["owner"] == player.color]
-                    if owned:
-                        cid = random.choice(owned)
-                        extra = random.randint(1, 3)
-                        room.cells[cid]["troops"] = min(100, room.cells[cid]["troops"] + extra)
-                        await broadcast(room, {
-                            "type": "bonus",
-                            "color": player.color,
-                            "cell": cid,
-                            "amount": extra
-                        })
-
-                    finished = await check_game_over(room)
-                    if finished:
-                        continue
-
-                    room.current_player_color = next_player_color(room)
-                    await broadcast_state(room)
-                    continue
-
-    except WebSocketDisconnect:
-        await unregister(room, ws)
-
-
-# ------------------------------
-# RUN
-# ------------------------------
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import msgpack
+import orjson
+import os
+import random
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from pydantic import ValidationError
+
+from map_gen import build_map
+from models import WsMessage
+
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
+app = FastAPI()
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Renk sırası
+colors_order = ["blue", "red", "green", "yellow"]
+
+# Renkler owners dizisinde küçük int olarak tutulur (-1 = sahipsiz)
+NONE_OWNER = -1
+COLOR_TO_IDX = {c: i for i, c in enumerate(colors_order)}
+IDX_TO_COLOR = list(colors_order)
+
+
+# ------------------------------
+# PLAYER
+# ------------------------------
+class Player:
+    def __init__(self, websocket: WebSocket, color: str):
+        self.websocket = websocket
+        self.color = color
+        self.color_idx = COLOR_TO_IDX[color]
+        self.name: Optional[str] = None
+        self.is_bot: bool = False
+        # ?binary=1 ile bağlanan istemciler msgpack alır, diğerleri JSON
+        self.binary_proto: bool = False
+        # Giden mesajlar kuyruğa yazılır; relay task kuyruğu boşaltır.
+        # Böylece yavaş bir istemci odanın geri kalanını bekletmez.
+        self.send_queue: asyncio.Queue = asyncio.Queue(maxsize=32)
+        self.relay_task: Optional[asyncio.Task] = None
+
+    @property
+    def label(self):
+        if self.name:
+            return self.name
+        if self.is_bot:
+            return "ai"
+        return self.color
+
+
+# ------------------------------
+# GAME STATE (ODA BAZLI)
+# ------------------------------
+class GameState:
+    def __init__(self):
+        self.started = False
+        self.max_players = 4
+        self.map_radius = 3
+        self.difficulty = 2
+
+        self.players_by_ws: Dict[WebSocket, Player] = {}
+        self.players_by_color: Dict[str, Player] = {}
+        self.free_colors: List[str] = list(colors_order)
+
+        # Hücreler SoA düzeninde: dict-of-dicts yerine paralel diziler
+        self.q = np.empty(0, dtype=np.int16)
+        self.r = np.empty(0, dtype=np.int16)
+        self.owners = np.empty(0, dtype=np.int8)
+        self.troops = np.zeros(0, dtype=np.int16)
+        self.neighbors: Dict[int, frozenset] = {}
+        self.last_moves: deque = deque(maxlen=8)
+        self.current_player_color: Optional[str] = None
+
+        self.state_version = 0
+        self.cell_dirty: set = set()
+        self.owned_by: Dict[str, set] = {c: set() for c in colors_order}
+        self.cells_count: Dict[str, int] = {c: 0 for c in colors_order}
+        self.troops_count: Dict[str, int] = {c: 0 for c in colors_order}
+        self.turn_order: List[str] = []
+        self.turn_idx = 0
+
+        # Oyuncu bilgisi her broadcast'te değil, sadece join/leave/set_name'de değişir
+        self._players_info_cache: Optional[dict] = None
+        self.players_info_version = 0
+        # (key, json bytes, msgpack bytes) — aynı lobi arka arkaya tekrar kodlanmaz
+        self._lobby_cache: Optional[tuple] = None
+
+        self.lock = asyncio.Lock()
+
+    def reset_game(self):
+        self.started = False
+        self.q = np.empty(0, dtype=np.int16)
+        self.r = np.empty(0, dtype=np.int16)
+        self.owners = np.empty(0, dtype=np.int8)
+        self.troops = np.zeros(0, dtype=np.int16)
+        self.neighbors = {}
+        self.last_moves = deque(maxlen=8)
+        self.current_player_color = None
+        self.state_version = 0
+        self.cell_dirty = set()
+        self.owned_by = {c: set() for c in colors_order}
+        self.cells_count = {c: 0 for c in colors_order}
+        self.troops_count = {c: 0 for c in colors_order}
+        self.turn_order = []
+        self.turn_idx = 0
+
+    def players_info_payload(self):
+        if self._players_info_cache is None:
+            self._players_info_cache = {
+                col: {"name": p.name, "is_bot": p.is_bot}
+                for col, p in self.players_by_color.items()
+            }
+        return self._players_info_cache
+
+    def invalidate_players_info(self):
+        self._players_info_cache = None
+        self.players_info_version += 1
+
+    def stats(self):
+        return {
+            c: {"cells": self.cells_count[c], "troops": self.troops_count[c]}
+            for c in colors_order
+        }
+
+    def alive_colors(self):
+        return [c for c in colors_order if self.cells_count[c] > 0]
+
+    # Sıra döngüsü sadece bir renk ölünce/ayrılınca yeniden kurulur
+    def rebuild_turn_order(self):
+        self.turn_order = self.alive_colors()
+        if self.current_player_color in self.turn_order:
+            self.turn_idx = self.turn_order.index(self.current_player_color)
+        else:
+            self.turn_idx = -1
+
+
+# ------------------------------
+# TÜM ODALAR
+# ------------------------------
+# Odalar süreç-yerelidir: tek uvicorn worker ile tüm odalar aynı süreçte
+# yaşar (Procfile böyle çalıştırır). Birden fazla worker'a ölçeklemek
+# gerekirse, proxy'nin aynı odanın tüm bağlantılarını aynı worker'a
+# sabitlemesi şarttır — ör. nginx'te "hash $arg_room consistent" ile
+# room_id üzerinden tutarlı hash. Worker'lar arası ortak oda desteklenmez.
+rooms: Dict[str, GameState] = {}
+
+
+def get_room(room_id: str) -> GameState:
+    if room_id not in rooms:
+        rooms[room_id] = GameState()
+    return rooms[room_id]
+
+
+# ------------------------------
+# HELPER FUNCTIONS
+# ------------------------------
+def _dumps(payload: dict) -> bytes:
+    # OPT_NON_STR_KEYS: cells dict int anahtarlı, json.dumps gibi stringe çevrilsin
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _packb(payload: dict) -> bytes:
+    # msgpack int anahtarları olduğu gibi kodlar, stringe çevirmeye gerek yok
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+async def send_json_safe(ws: WebSocket, payload: dict, binary: bool = False):
+    try:
+        await ws.send_bytes(_packb(payload) if binary else _dumps(payload))
+    except:
+        pass
+
+
+def queue_send_raw(player: Player, data: bytes) -> bool:
+    try:
+        player.send_queue.put_nowait(data)
+        return True
+    except asyncio.QueueFull:
+        return False
+
+
+def queue_send(player: Player, payload: dict) -> bool:
+    return queue_send_raw(player, _packb(payload) if player.binary_proto else _dumps(payload))
+
+
+async def _relay(room: GameState, player: Player):
+    ws = player.websocket
+    try:
+        while True:
+            data = await player.send_queue.get()
+            await ws.send_bytes(data)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        await unregister(room, ws)
+
+
+async def broadcast(room: GameState, payload: dict):
+    data = _dumps(payload)
+    bdata = None
+    dead = []
+    for p in room.players_by_color.values():
+        if p.binary_proto:
+            if bdata is None:
+                bdata = _packb(payload)
+            out = bdata
+        else:
+            out = data
+        try:
+            p.send_queue.put_nowait(out)
+        except asyncio.QueueFull:
+            # Kuyruğu 32 mesajdır boşaltamayan istemci ölü sayılır
+            dead.append(p.websocket)
+
+    for ws in dead:
+        schedule_unregister(room, ws)
+
+
+# broadcast/send_lobby oda kilidi tutulurken de çağrılabilir; ölü istemci
+# temizliği kilidi yeniden almak zorunda olduğundan ayrı task'a ertelenir
+def schedule_unregister(room: GameState, ws: WebSocket):
+    asyncio.create_task(unregister(room, ws))
+
+
+async def unregister(room: GameState, ws: WebSocket):
+    async with room.lock:
+        player = room.players_by_ws.pop(ws, None)
+        if not player:
+            return
+
+        room.players_by_color.pop(player.color, None)
+        room.invalidate_players_info()
+        room.free_colors.append(player.color)
+        room.free_colors.sort(key=COLOR_TO_IDX.__getitem__)
+
+        # Relay kendi içinden unregister çağırabilir; kendi kendini iptal etmesin
+        if player.relay_task is not None and player.relay_task is not asyncio.current_task():
+            player.relay_task.cancel()
+
+        if not room.players_by_ws:
+            room.reset_game()
+        else:
+            if room.started:
+                owned = room.owned_by[player.color]
+                if owned:
+                    idxs = np.fromiter(owned, dtype=np.intp)
+                    room.owners[idxs] = NONE_OWNER
+                    room.troops[idxs] = 0
+                    room.cell_dirty.update(owned)
+                room.owned_by[player.color] = set()
+                room.cells_count[player.color] = 0
+                room.troops_count[player.color] = 0
+                room.rebuild_turn_order()
+
+                alive = room.alive_colors()
+                if len(alive) == 1:
+                    winner = alive[0]
+                    for p in room.players_by_ws.values():
+                        result = "win" if p.color == winner else "lose"
+                        queue_send(p, {"type": "game_over", "result": result})
+                    room.reset_game()
+                else:
+                    if room.current_player_color == player.color:
+                        room.current_player_color = next_player_color(room)
+
+            await send_lobby(room)
+
+    # Kuyruk taşmasıyla atılan istemci hâlâ bağlı olabilir; zombi olarak
+    # frame gönderip hiçbir şey almasın diye soket burada kapatılır
+    try:
+        await ws.close()
+    except Exception:
+        pass
+
+
+async def send_lobby(room: GameState):
+    # Lobi payload'ı sadece bu beşliden türüyor; değişmediyse kodlanmış hali yeniden kullanılır
+    key = (
+        room.started,
+        room.max_players,
+        room.map_radius,
+        room.difficulty,
+        room.players_info_version,
+    )
+    if room._lobby_cache is None or room._lobby_cache[0] != key:
+        payload = {
+            "type": "lobby",
+            "started": room.started,
+            "players_info": room.players_info_payload(),
+            "max_players": room.max_players,
+            "map_radius": room.map_radius,
+            "difficulty": room.difficulty
+        }
+        room._lobby_cache = (key, _dumps(payload), _packb(payload))
+
+    _, data, bdata = room._lobby_cache
+    for p in room.players_by_color.values():
+        if not queue_send_raw(p, bdata if p.binary_proto else data):
+            schedule_unregister(room, p.websocket)
+
+
+def next_player_color(room: GameState) -> Optional[str]:
+    if not room.turn_order:
+        return None
+    room.turn_idx = (room.turn_idx + 1) % len(room.turn_order)
+    return room.turn_order[room.turn_idx]
+
+
+# Hazır şablonun copy()'si anahtar ekleme maliyetini atlar
+CELL_TEMPLATE = {"id": 0, "q": 0, "r": 0, "owner": None, "troops": 0}
+
+
+# Tel formatı aynı kalsın diye SoA dizileri sadece gönderirken dict'e çevrilir
+def cell_wire(room: GameState, cid: int) -> dict:
+    owner_idx = room.owners[cid]
+    d = CELL_TEMPLATE.copy()
+    d["id"] = cid
+    d["q"] = int(room.q[cid])
+    d["r"] = int(room.r[cid])
+    d["owner"] = IDX_TO_COLOR[owner_idx] if owner_idx != NONE_OWNER else None
+    d["troops"] = int(room.troops[cid])
+    return d
+
+
+def cells_wire(room: GameState) -> dict:
+    return {cid: cell_wire(room, cid) for cid in range(len(room.q))}
+
+
+# İkili tam anlık görüntünün 1 baytlık tip öneki; JSON '{' ve msgpack fixmap
+# (0x8x) ile çakışmaz, istemci ilk bayttan ayırt eder
+STATE_BLOB_OPCODE = 0x01
+
+
+# Topoloji oyun başına bir kere gider; sonrasında ikili istemci hücreleri
+# blob içindeki konumundan çözer
+def map_topology_payload(room: GameState) -> dict:
+    return {
+        "type": "map_topology",
+        "q": room.q.tolist(),
+        "r": room.r.tolist(),
+        "moves": list(room.last_moves),
+        "current_player": room.current_player_color,
+        "players_info": room.players_info_payload(),
+    }
+
+
+# Hücre başına 1 bayt owner + 2 bayt troops, id sırasıyla — alan adı tekrarı yok
+def pack_state(room: GameState) -> bytes:
+    return bytes([STATE_BLOB_OPCODE]) + room.owners.tobytes() + room.troops.astype("<u2").tobytes()
+
+
+def apply_transfer(room, color, src, dst, amount):
+    owners = room.owners
+    troops = room.troops
+    n = len(owners)
+    if not (0 <= src < n and 0 <= dst < n):
+        return None
+
+    color_idx = COLOR_TO_IDX[color]
+    if owners[src] != color_idx:
+        return None
+    if amount <= 0 or troops[src] < amount:
+        return None
+    if dst not in room.neighbors.get(src, ()):
+        return None
+
+    troops[src] -= amount
+    room.troops_count[color] -= amount
+    room.cell_dirty.add(src)
+    room.cell_dirty.add(dst)
+
+    defender_idx = int(owners[dst])
+
+    if defender_idx == NONE_OWNER:
+        owners[dst] = color_idx
+        troops[dst] = amount
+        room.owned_by[color].add(dst)
+        room.cells_count[color] += 1
+        room.troops_count[color] += amount
+        return "occupy"
+
+    if defender_idx == color_idx:
+        troops[dst] += amount
+        room.troops_count[color] += amount
+        return "transfer"
+
+    # battle
+    defender = IDX_TO_COLOR[defender_idx]
+    defender_troops = int(troops[dst])
+    if amount > defender_troops:
+        room.owned_by[defender].discard(dst)
+        room.owned_by[color].add(dst)
+        room.cells_count[defender] -= 1
+        room.troops_count[defender] -= defender_troops
+        room.cells_count[color] += 1
+        room.troops_count[color] += amount - defender_troops
+        owners[dst] = color_idx
+        troops[dst] = amount - defender_troops
+        if room.cells_count[defender] == 0:
+            room.rebuild_turn_order()
+    else:
+        troops[dst] -= amount
+        room.troops_count[defender] -= amount
+    return "battle"
+
+
+async def check_game_over(room: GameState):
+    alive = room.alive_colors()
+    if len(alive) == 1:
+        winner = alive[0]
+        for p in room.players_by_ws.values():
+            result = "win" if p.color == winner else "lose"
+            queue_send(p, {"type": "game_over", "result": result})
+        room.reset_game()
+        await send_lobby(room)
+        return True
+    return False
+
+
+# Tam snapshot: başlamış odaya geç katılanlar / yeniden bağlananlar için.
+# "version" sayesinde istemci sonraki turn_result delta'larına hizalanır.
+def full_state_payload(room: GameState) -> dict:
+    return {
+        "type": "state",
+        "cells": cells_wire(room),
+        "moves": list(room.last_moves),
+        "current_player": room.current_player_color,
+        "players_info": room.players_info_payload(),
+        "version": room.state_version,
+        "started": room.started,
+        "max_players": room.max_players,
+        "map_radius": room.map_radius,
+        "difficulty": room.difficulty,
+    }
+
+
+# Her hamlede tüm harita yerine sadece değişen hücreler gönderilir
+def state_delta_fields(room: GameState) -> dict:
+    room.state_version += 1
+    changed = {cid: cell_wire(room, cid) for cid in room.cell_dirty}
+    room.cell_dirty.clear()
+    return {
+        "version": room.state_version,
+        "changed": changed,
+        "moves": list(room.last_moves),
+        "current_player": room.current_player_color,
+    }
+
+
+# ------------------------------
+# MESSAGE HANDLERS
+# ------------------------------
+async def handle_config(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    async with room.lock:
+        room.max_players = msg.max_players if msg.max_players is not None else 2
+    await send_lobby(room)
+
+
+async def handle_config_map(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    async with room.lock:
+        room.map_radius = msg.map_radius if msg.map_radius is not None else 3
+    await send_lobby(room)
+
+
+async def handle_config_difficulty(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    async with room.lock:
+        room.difficulty = msg.difficulty if msg.difficulty is not None else 2
+    await send_lobby(room)
+
+
+async def handle_set_name(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    async with room.lock:
+        name = (msg.name or "").strip()
+        if name:
+            player.name = name[:20]
+            room.invalidate_players_info()
+    await send_lobby(room)
+
+
+# State değiştirmez, kilit gerektirmez
+async def handle_emoji(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    await broadcast(room, {
+        "type": "emoji",
+        "emoji": msg.emoji or "🙂",
+        "from": player.label
+    })
+
+
+async def handle_start(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    async with room.lock:
+        if room.started:
+            return
+        if len(room.players_by_ws) < 2:
+            queue_send(player, {"type": "error", "message": "En az 2 oyuncu gerekir"})
+            return
+
+        room.q, room.r, room.neighbors = build_map(room.map_radius)
+        n = len(room.q)
+        room.owners = np.full(n, NONE_OWNER, dtype=np.int8)
+        room.troops = np.zeros(n, dtype=np.int16)
+
+        order = list(room.players_by_ws.values())
+        random.shuffle(order)
+
+        starters = random.sample(range(n), len(order))
+        for p, cid in zip(order, starters):
+            room.owners[cid] = COLOR_TO_IDX[p.color]
+            room.troops[cid] = 10
+            room.owned_by[p.color].add(cid)
+            room.cells_count[p.color] += 1
+            room.troops_count[p.color] += 10
+
+        room.started = True
+        room.last_moves.clear()
+        room.state_version = 0
+        room.cell_dirty.clear()
+
+        for c in colors_order:
+            if c in room.players_by_color:
+                room.current_player_color = c
+                break
+        room.rebuild_turn_order()
+
+        start_data = None
+        topo = None
+        blob = None
+        for p in room.players_by_color.values():
+            if p.binary_proto:
+                if blob is None:
+                    topo = _packb(map_topology_payload(room))
+                    blob = pack_state(room)
+                ok = queue_send_raw(p, topo) and queue_send_raw(p, blob)
+            else:
+                if start_data is None:
+                    start_data = _dumps({
+                        "type": "start_game",
+                        "cells": cells_wire(room),
+                        "moves": list(room.last_moves),
+                        "current_player": room.current_player_color,
+                        "players_info": room.players_info_payload(),
+                    })
+                ok = queue_send_raw(p, start_data)
+            # start_game'i kaçıran istemci kalıcı desenkron kalır;
+            # broadcast'teki taşma kuralı burada da geçerli: ölü sayılır
+            if not ok:
+                schedule_unregister(room, p.websocket)
+
+
+async def handle_transfer(room: GameState, player: Player, msg: WsMessage, ws: WebSocket):
+    async with room.lock:
+        if not room.started:
+            return
+        if room.current_player_color != player.color:
+            return
+
+        if msg.source is None or msg.target is None or msg.amount is None:
+            return
+
+        src = msg.source
+        dst = msg.target
+        amt = msg.amount
+
+        kind = apply_transfer(room, player.color, src, dst, amt)
+        if not kind:
+            return
+
+        room.last_moves.append({"src": src, "dst": dst, "color": player.color})
+
+        # +1 takviye: sahip olunan tüm hücrelere tek vektörel işlem
+        mask = (room.owners == player.color_idx) & (room.troops < 100)
+        room.troops[mask] += 1
+        regrown = np.flatnonzero(mask)
+        room.troops_count[player.color] += int(regrown.size)
+        room.cell_dirty.update(regrown.tolist())
+
+        bonus = None
+        owned = room.owned_by[player.color]
+        if owned:
+            cid = random.choice(tuple(owned))
+            extra = random.randint(1, 3)
+            before = int(room.troops[cid])
+            room.troops[cid] = min(100, before + extra)
+            room.troops_count[player.color] += int(room.troops[cid]) - before
+            room.cell_dirty.add(cid)
+            bonus = {"color": player.color, "cell": cid, "amount": extra}
+
+        if len(room.alive_colors()) > 1:
+            room.current_player_color = next_player_color(room)
+
+        # Hamle başına 3 ayrı broadcast yerine tek zarf; apply_transfer her
+        # başarılı hamlede src/dst'yi kirlettiği için delta asla boş olmaz.
+        # Zarf check_game_over'dan ÖNCE kuyruğa girer ki kazandıran hamle
+        # istemciye game_over'dan önce ulaşsın; broadcast kilit altında
+        # beklemez, sadece kuyruğa yazar.
+        payload = {"type": "turn_result", "kind": kind, "bonus": bonus}
+        payload.update(state_delta_fields(room))
+        await broadcast(room, payload)
+
+        await check_game_over(room)
+
+
+HANDLERS = {
+    "config": handle_config,
+    "config_map": handle_config_map,
+    "config_difficulty": handle_config_difficulty,
+    "set_name": handle_set_name,
+    "emoji": handle_emoji,
+    "start": handle_start,
+    "transfer": handle_transfer,
+}
+
+
+# ------------------------------
+# WEBSOCKET ENDPOINT
+# ------------------------------
+@app.websocket("/ws")
+async def websocket_endpoint(ws: WebSocket):
+    await ws.accept()
+
+    # ROOM ID OKU
+    room_id = ws.query_params.get("room", "default")
+    room = get_room(room_id)
+    binary_proto = ws.query_params.get("binary") == "1"
+
+    # PLAYER KAYDEDİLİYOR
+    async with room.lock:
+        free = room.free_colors.pop(0) if room.free_colors else None
+
+        if free is None:
+            await send_json_safe(ws, {"type": "error", "message": "Oda dolu"}, binary_proto)
+            await ws.close()
+            return
+
+        player = Player(ws, free)
+        player.binary_proto = binary_proto
+        room.players_by_ws[ws] = player
+        room.players_by_color[free] = player
+        room.invalidate_players_info()
+
+        player.relay_task = asyncio.create_task(_relay(room, player))
+        queue_send(player, {"type": "you_are", "color": free})
+
+        # Oyun sürerken katılan istemci sadece delta görür ve haritayı
+        # kuramaz; önce tam snapshot gönderilir
+        if room.started:
+            if player.binary_proto:
+                queue_send_raw(player, _packb(map_topology_payload(room)))
+                queue_send_raw(player, pack_state(room))
+            else:
+                queue_send(player, full_state_payload(room))
+
+        await send_lobby(room)
+
+    try:
+        while True:
+            raw = await ws.receive_text()
+
+            # pydantic-core tek geçişte hem parse hem tip doğrulaması yapar
+            try:
+                msg = WsMessage.model_validate_json(raw)
+            except ValidationError:
+                continue
+
+            handler = HANDLERS.get(msg.type)
+            if handler is None:
+                continue
+
+            player = room.players_by_ws.get(ws)
+            if not player:
+                continue
+
+            await handler(room, player, msg, ws)
+
+    except WebSocketDisconnect:
+        await unregister(room, ws)
+
+
+# ------------------------------
+# RUN
+# ------------------------------
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        # state payload'ları çok tekrarlı JSON; deflate 5-20x küçültür.
+        # Küçük transfer_event/bonus mesajları için CPU maliyeti kabul edilebilir.
+        ws_per_message_deflate=True,
+        reload=False,
+    )
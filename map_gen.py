@@ -1,22 +1,36 @@
-def axial_ring(radius):
-    cells = []
-    for q in range(-radius, radius + 1):
-        for r in range(-radius, radius + 1):
-            s = -q - r
-            if abs(s) <= radius:
-                cells.append((q, r))
-    return cells
+import functools
 
-def generate_map(radius):
-    cells = {}
-    id_counter = 1
-    for q, r in axial_ring(radius):
-        cells[id_counter] = {
-            "id": id_counter,
-            "q": q,
-            "r": r,
-            "owner": None,
-            "troops": 0
-        }
-        id_counter += 1
-    return cells
+import numpy as np
+
+# Altıgen komşu yönleri (axial)
+HEX_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)]
+
+
+# Harita iskeleti (koordinatlar + komşuluk) yarıçapın saf fonksiyonu:
+# aynı yarıçapla açılan her oda aynı salt-okunur iskeleti paylaşır,
+# odaya özel olan sadece owners/troops dizileridir.
+@functools.lru_cache(maxsize=8)
+def build_map(radius: int):
+    R = max(1, min(radius, 6))
+    # Koordinatlar iç içe döngü yerine meshgrid + maske ile tek seferde üretilir;
+    # 'ij' indeksleme eski (q dış, r iç) sıralamayı korur
+    coords = np.arange(-R, R + 1, dtype=np.int16)
+    qs, rs = np.meshgrid(coords, coords, indexing="ij")
+    mask = np.abs(-qs - rs) <= R
+    q_arr = qs[mask]
+    r_arr = rs[mask]
+    # İskelet odalar arası paylaşılıyor, yanlışlıkla yazılamasın
+    q_arr.flags.writeable = False
+    r_arr.flags.writeable = False
+
+    # Harita sabit: komşuluk bir kere hesaplanır, hamlede set lookup yeter
+    qr_pairs = list(zip(q_arr.tolist(), r_arr.tolist()))
+    by_qr = {qr: i for i, qr in enumerate(qr_pairs)}
+    neighbors = {}
+    for i, (q, r) in enumerate(qr_pairs):
+        neighbors[i] = frozenset(
+            by_qr[(q + dq, r + dr)]
+            for dq, dr in HEX_DIRECTIONS
+            if (q + dq, r + dr) in by_qr
+        )
+    return q_arr, r_arr, neighbors